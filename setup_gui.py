@@ -1,16 +1,53 @@
 #!/usr/bin/env python3
+import collections
+import copy
+import hashlib
 import os
+import re
 import subprocess
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from flask import Flask, request, render_template_string, redirect, url_for
+from flask import Flask, request, redirect, url_for, jsonify, Response, stream_with_context
+from flask_caching import Cache
+from jinja2 import Template
 import yaml
 
+try:
+    # libyaml-backed C implementations; fall back to pure Python if PyYAML
+    # was built without them.
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
+try:
+    # Talk to dockerd over the Unix socket directly; forking the docker
+    # compose CLI costs ~1s per invocation even for a no-op.
+    import docker
+except ImportError:
+    docker = None
+
 app = Flask(__name__)
 
+# Memoizes the rendered /setup page between config changes, so bookmark
+# refreshers don't even hit load_config or the template.
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 60})
+
+# Single worker so apply runs never overlap; POSTs just queue up behind it.
+_EXEC = ThreadPoolExecutor(max_workers=1)
+_APPLY_STATE = {"state": "idle", "error": None}
+# Ring buffer of docker compose output for the /log SSE endpoint
+_LOG = collections.deque(maxlen=500)
+
 CONFIG_PATH = Path("/opt/lustylibrary-installer/config.yml")
-DEFAULT_CONFIG = {
+# Hash of the docker-compose.yml from the last successful deploy
+_COMPOSE_HASH_PATH = Path("/opt/lustylibrary-installer/.compose.hash")
+# Kept as a JSON string: json.loads hands back a fresh deep structure on
+# every call (faster than deepcopy), and handlers can't mutate the shared
+# defaults by accident.
+_DEFAULT_CONFIG_JSON = json.dumps({
     "wifi": {
         "ssid": "LustyLibrary",
         "password": "lustybooks123",
@@ -29,22 +66,88 @@ DEFAULT_CONFIG = {
         "server_path_audio": "/data/media/audiobook",
         "server_path_books": "/data/media/calibre",
     },
-}
+})
+
+
+# Parsed-config cache so repeat GETs don't re-run the YAML parser.
+# Keyed on (mtime_ns, size); save_config or an external edit invalidates it.
+_CFG_CACHE = {"key": None, "val": None}
 
 
 def load_config():
-    if CONFIG_PATH.exists():
-        with CONFIG_PATH.open("r") as f:
-            return yaml.safe_load(f)
-    # deep copy-ish
-    cfg = yaml.safe_load(yaml.safe_dump(DEFAULT_CONFIG))
-    return cfg
+    try:
+        st = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return json.loads(_DEFAULT_CONFIG_JSON)
+    key = (st.st_mtime_ns, st.st_size)
+    if key == _CFG_CACHE["key"]:
+        return copy.deepcopy(_CFG_CACHE["val"])
+    with CONFIG_PATH.open("r") as f:
+        cfg = yaml.load(f, Loader=_YamlLoader)
+    _CFG_CACHE["key"] = key
+    _CFG_CACHE["val"] = cfg
+    # Hand out a copy so mutations in setup() can't poison the cache.
+    return copy.deepcopy(cfg)
 
 
 def save_config(cfg):
-    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(CONFIG_PATH.parent)
     with CONFIG_PATH.open("w") as f:
-        yaml.safe_dump(cfg, f)
+        yaml.dump(cfg, f, Dumper=_YamlDumper)
+
+
+# Staged file writes and service restarts, flushed in one pass at the end
+# of an apply run. Only ever touched from the single _EXEC worker thread.
+_pending_writes: list = []  # (Path, text, mode-or-None)
+_pending_restarts: set = set()
+
+
+# Directories we've already created/confirmed this process lifetime, so
+# repeat applies skip the stat+mkdir syscalls entirely.
+_known_dirs: set = set()
+
+
+def _ensure_dir(p):
+    p = Path(p)
+    s = str(p)
+    if s in _known_dirs:
+        return
+    p.mkdir(parents=True, exist_ok=True)
+    _known_dirs.add(s)
+
+
+def _stage_write(path, text, mode=None):
+    _pending_writes.append((Path(path), text, mode))
+
+
+def _flush_pending():
+    """
+    Write all staged files atomically (tempfile + os.replace), then issue a
+    single systemctl restart covering every affected service. Batching keeps
+    the SD-card flushes and service-restart stalls to one round each.
+    """
+    for path, text, mode in _pending_writes:
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(text)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    _pending_writes.clear()
+
+    if _pending_restarts:
+        # Fire the restarts concurrently and wait for all of them; systemd
+        # handles parallel restart requests fine and each one blocks for
+        # hundreds of ms on its own.
+        procs = [
+            subprocess.Popen(["systemctl", "restart", svc])
+            for svc in sorted(_pending_restarts)
+        ]
+        for p in procs:
+            try:
+                p.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                pass
+        _pending_restarts.clear()
 
 
 def get_storage_devices():
@@ -141,60 +244,36 @@ WantedBy=multi-user.target
 def generate_docker_compose(cfg):
     """Generate a docker-compose.yml based on selected options."""
     media_root = cfg["storage"]["media_root"]
-    install_abs = cfg["apps"]["install_audiobookshelf"]
-    install_cweb = cfg["apps"]["install_calibre_web"]
-
-    lines = [
-        'version: "3.8"',
-        "",
-        "services:",
-    ]
-
-    if install_abs:
-        lines += [
-            "  audiobookshelf:",
-            "    image: ghcr.io/advplyr/audiobookshelf:latest",
-            "    container_name: audiobookshelf",
-            "    ports:",
-            "      - \"13378:80\"",
-            "    environment:",
-            "      - TZ=America/Chicago",
-            "      - AUDIOBOOKSHELF_DISABLE_UPDATES=true",
-            "    volumes:",
-            f"      - {media_root}/audiobooks:/audiobooks",
-            f"      - {media_root}/config/audiobookshelf:/config",
-            "    restart: unless-stopped",
-            "",
-        ]
 
-    if install_cweb:
-        lines += [
-            "  calibre-web:",
-            "    image: lscr.io/linuxserver/calibre-web:latest",
-            "    container_name: calibre-web",
-            "    ports:",
-            "      - \"8083:8083\"",
-            "    environment:",
-            "      - PUID=1000",
-            "      - PGID=1000",
-            "      - TZ=America/Chicago",
-            "    volumes:",
-            f"      - {media_root}/books:/books",
-            f"      - {media_root}/config/calibre:/config",
-            "    restart: unless-stopped",
-            "",
-        ]
+    text = _COMPOSE_TMPL.render(
+        install_abs=cfg["apps"]["install_audiobookshelf"],
+        install_cweb=cfg["apps"]["install_calibre_web"],
+        media_root=media_root,
+    )
 
     compose_path = Path("/home/pi/library-server")
-    compose_path.mkdir(parents=True, exist_ok=True)
-    with (compose_path / "docker-compose.yml").open("w") as f:
-        f.write("\n".join(lines))
+    _ensure_dir(compose_path)
+    _stage_write(compose_path / "docker-compose.yml", text)
 
     # Ensure directories exist
     for sub in ("audiobooks", "books", "config"):
-        Path(media_root, sub).mkdir(parents=True, exist_ok=True)
+        _ensure_dir(Path(media_root, sub))
+
+    # Content hash of what we generated, so callers can skip the docker
+    # invocation when nothing actually changed since the last deploy.
+    compose_hash = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    try:
+        changed = _COMPOSE_HASH_PATH.read_text().strip() != compose_hash
+    except OSError:
+        changed = True
 
-    return compose_path / "docker-compose.yml"
+    return compose_path / "docker-compose.yml", compose_hash, changed
+
+
+_RE_SSID = re.compile(r"^ssid=.*$", re.M)
+_RE_WPAPASS = re.compile(r"^wpa_passphrase=.*$", re.M)
+# Everything from "interface wlan0" up to the next interface stanza (or EOF)
+_RE_WLAN0_BLOCK = re.compile(r"(?ms)^interface wlan0\b.*?(?=^interface |\Z)")
 
 
 def apply_wifi_config(cfg):
@@ -209,20 +288,14 @@ def apply_wifi_config(cfg):
     # Update hostapd.conf
     hostapd_conf = Path("/etc/hostapd/hostapd.conf")
     if hostapd_conf.exists():
-        text = hostapd_conf.read_text()
-        lines = []
-        for line in text.splitlines():
-            if line.startswith("ssid="):
-                lines.append(f"ssid={ssid}")
-            elif line.startswith("wpa_passphrase="):
-                lines.append(f"wpa_passphrase={password}")
-            else:
-                lines.append(line)
-        hostapd_conf.write_text("\n".join(lines))
-        try:
-            subprocess.run(["systemctl", "restart", "hostapd"], check=False)
-        except Exception:
-            pass
+        old = hostapd_conf.read_text()
+        new = _RE_SSID.sub(f"ssid={ssid}", old)
+        new = _RE_WPAPASS.sub(f"wpa_passphrase={password}", new)
+        # Identical content means the running service is already in the
+        # target state; skip both the write and the restart.
+        if new != old:
+            _stage_write(hostapd_conf, new)
+            _pending_restarts.add("hostapd")
 
     # Update dhcpcd.conf static IP for wlan0
     dhcpcd = Path("/etc/dhcpcd.conf")
@@ -232,24 +305,12 @@ def apply_wifi_config(cfg):
         f"  nohook wpa_supplicant\n"
     )
     if dhcpcd.exists():
-        text = dhcpcd.read_text()
-        # crude: remove old interface wlan0 block, append new
-        new_lines = []
-        skip = False
-        for line in text.splitlines():
-            if line.startswith("interface wlan0"):
-                skip = True
-                continue
-            if skip and line.startswith("interface "):
-                skip = False
-            if not skip:
-                new_lines.append(line)
-        new_text = "\n".join(new_lines) + block
-        dhcpcd.write_text(new_text)
-        try:
-            subprocess.run(["systemctl", "restart", "dhcpcd"], check=False)
-        except Exception:
-            pass
+        old = dhcpcd.read_text()
+        # drop any old interface wlan0 block, append the new one
+        new = _RE_WLAN0_BLOCK.sub("", old) + block
+        if new != old:
+            _stage_write(dhcpcd, new)
+            _pending_restarts.add("dhcpcd")
 
 
 def apply_sync_config(cfg):
@@ -330,185 +391,235 @@ flock -n 9 || exit 0
   echo "==== $(date '+%F %T') — sync done ===="
 }} >>"$LOG" 2>&1
 """
-    script_path = Path("/usr/local/bin/sync_from_server.sh")
-    script_path.write_text(script)
-    script_path.chmod(0o755)
+    _stage_write(Path("/usr/local/bin/sync_from_server.sh"), script, mode=0o755)
     # NOTE: you already have eth0-watcher + systemd units in your other setup;
     # you can extend this function to drop those units too.
 
 
-FORM_TEMPLATE = """
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8">
-  <title>Lusty Library Setup</title>
-  <meta name="viewport" content="width=device-width,initial-scale=1">
-  <style>
-    body { font-family: system-ui, sans-serif; background:#111827; color:#f9fafb; margin:0; }
-    .wrap { max-width:800px; margin:4vh auto; background:#1f2937; padding:24px;
-            border-radius:16px; box-shadow:0 10px 40px rgba(0,0,0,.6); }
-    h1 { margin-top:0; }
-    fieldset { border:1px solid #374151; margin-bottom:18px; border-radius:8px; }
-    legend { padding:0 8px; color:#9ca3af; }
-    label { display:block; margin:8px 0; }
-    input,select { width:100%; padding:8px; border-radius:6px; border:1px solid #4b5563;
-                   background:#030712; color:#e5e7eb; }
-    .row { display:flex; gap:12px; }
-    .row > div { flex:1; }
-    button { background:#10b981; color:#022c22; border:0; padding:10px 18px; border-radius:999px;
-             font-weight:600; cursor:pointer; margin-top:10px; }
-    button:hover { background:#059669; }
-    .checkbox-row { display:flex; align-items:center; gap:8px; }
-    .checkbox-row input { width:auto; }
-    small { color:#9ca3af; }
-  </style>
-</head>
-<body>
-  <div class="wrap">
-    <h1>📚 Lusty Library Setup</h1>
-    <form method="post">
-      <fieldset>
-        <legend>Wi-Fi / Hotspot</legend>
-        <div class="row">
-          <div>
-            <label>SSID
-              <input name="wifi_ssid" value="{{ cfg.wifi.ssid }}" placeholder="e.g. LustyLibrary">
-            </label>
-          </div>
-          <div>
-            <label>Password
-              <input name="wifi_password" value="{{ cfg.wifi.password }}" placeholder="e.g. lustybooks123">
-            </label>
-          </div>
-        </div>
-        <label>Hotspot IP (wlan0)
-          <input name="wifi_ip" value="{{ cfg.wifi.ip }}" placeholder="e.g. 10.10.10.10">
-        </label>
-        <small>This will update hostapd and dhcpcd for wlan0.</small>
-      </fieldset>
-
-      <fieldset>
-        <legend>Storage</legend>
-        <label>Media root path
-          <input name="media_root" value="{{ cfg.storage.media_root }}" placeholder="e.g. /mnt/media">
-        </label>
-        <small>Subfolders like <code>audiobooks</code>, <code>books</code>, <code>config</code> will be created here.</small>
-
-        <label>Detected storage device to use (optional)
-          <select name="storage_device">
-            <option value="">-- Leave existing storage as-is --</option>
-            {% for d in devices %}
-              <option value="{{ d.path }}">{{ d.path }} ({{ d.size }}, {{ d.fstype or 'unformatted' }}, {% if d.mountpoint %}mounted at {{ d.mountpoint }}{% else %}not mounted{% endif %})</option>
-            {% endfor %}
-          </select>
-        </label>
-        <div class="checkbox-row">
-          <input type="checkbox" id="format_device" name="format_device">
-          <label for="format_device">Format selected device as ext4 and mount at {{ cfg.storage.media_root }} <strong>(⚠ erases all data on that device)</strong></label>
-        </div>
-        <small>If you're already using an attached drive for media, leave the device blank and do not check the format box.</small>
-      </fieldset>
-
-      <fieldset>
-        <legend>Apps to install</legend>
-        <div class="checkbox-row">
-          <input type="checkbox" id="abs" name="install_audiobookshelf" {% if cfg.apps.install_audiobookshelf %}checked{% endif %}>
-          <label for="abs">Install Audiobookshelf</label>
-        </div>
-        <div class="checkbox-row">
-          <input type="checkbox" id="cweb" name="install_calibre_web" {% if cfg.apps.install_calibre_web %}checked{% endif %}>
-          <label for="cweb">Install Calibre-Web</label>
-        </div>
-      </fieldset>
-
-      <fieldset>
-        <legend>Auto-sync from Server (optional)</legend>
-        <div class="checkbox-row">
-          <input type="checkbox" id="enable_sync" name="enable_sync" {% if cfg.sync.enable_sync %}checked{% endif %}>
-          <label for="enable_sync">Enable auto-sync from server when Ethernet is plugged in</label>
-        </div>
-        <div class="row">
-          <div>
-            <label>Server IP
-              <input name="server_ip" value="{{ cfg.sync.server_ip }}" placeholder="e.g. 192.168.0.139">
-            </label>
-          </div>
-        </div>
-        <label>Audiobooks path on server
-          <input name="server_path_audio" value="{{ cfg.sync.server_path_audio }}" placeholder="e.g. /data/media/audiobook">
-        </label>
-        <label>Books/Calibre path on server
-          <input name="server_path_books" value="{{ cfg.sync.server_path_books }}" placeholder="e.g. /data/media/calibre">
-        </label>
-        <small>These are the paths as they exist on the remote server share (for example <code>/data/media/audiobook</code>).</small>
-      </fieldset>
-
-      <button type="submit">Apply &amp; Generate Config</button>
-    </form>
-  </div>
-</body>
-</html>
-"""
+# One Engine API client shared across applies (lazy so import works on
+# machines without dockerd running).
+_DOCKER = None
+
+
+def _docker_client():
+    global _DOCKER
+    if _DOCKER is None:
+        _DOCKER = docker.from_env()
+    return _DOCKER
+
+
+def _deploy_stack(cfg):
+    """
+    Start/recreate the selected app containers straight over the Engine
+    API instead of forking the docker compose CLI. Mirrors the specs in
+    templates/compose.yml.j2.
+    """
+    client = _docker_client()
+    media_root = cfg["storage"]["media_root"]
+
+    specs = []
+    if cfg["apps"]["install_audiobookshelf"]:
+        specs.append({
+            "name": "audiobookshelf",
+            "image": "ghcr.io/advplyr/audiobookshelf:latest",
+            "ports": {"80/tcp": 13378},
+            "environment": ["TZ=America/Chicago", "AUDIOBOOKSHELF_DISABLE_UPDATES=true"],
+            "volumes": {
+                f"{media_root}/audiobooks": {"bind": "/audiobooks", "mode": "rw"},
+                f"{media_root}/config/audiobookshelf": {"bind": "/config", "mode": "rw"},
+            },
+        })
+    if cfg["apps"]["install_calibre_web"]:
+        specs.append({
+            "name": "calibre-web",
+            "image": "lscr.io/linuxserver/calibre-web:latest",
+            "ports": {"8083/tcp": 8083},
+            "environment": ["PUID=1000", "PGID=1000", "TZ=America/Chicago"],
+            "volumes": {
+                f"{media_root}/books": {"bind": "/books", "mode": "rw"},
+                f"{media_root}/config/calibre": {"bind": "/config", "mode": "rw"},
+            },
+        })
+
+    for spec in specs:
+        name = spec["name"]
+        try:
+            existing = client.containers.get(name)
+        except docker.errors.NotFound:
+            existing = None
+        if existing is not None:
+            _LOG.append(f"Recreating {name}...\n")
+            existing.stop()
+            existing.remove()
+        else:
+            _LOG.append(f"Creating {name}...\n")
+        client.containers.run(
+            spec["image"],
+            name=name,
+            ports=spec["ports"],
+            environment=spec["environment"],
+            volumes=spec["volumes"],
+            restart_policy={"Name": "unless-stopped"},
+            detach=True,
+        )
+        _LOG.append(f"{name} started\n")
+
+
+def _apply_all(cfg, storage_device=None, format_device=False, changed=None):
+    """
+    Run the slow apply steps (format/mount, wifi, compose, sync, docker up)
+    off the request thread. `changed` is the set of config sections that
+    differ from the previous config; appliers whose inputs didn't change
+    are skipped. Progress is reported via _APPLY_STATE for the /status
+    endpoint.
+    """
+    if changed is None:
+        changed = {"wifi", "storage", "apps", "sync"}
+    _APPLY_STATE["state"] = "running"
+    _APPLY_STATE["error"] = None
+    try:
+        # If user selected a device and checked the format box, do the
+        # destructive format+mount first so media dirs land on the new disk
+        if storage_device and format_device:
+            try:
+                format_and_mount_device(storage_device, cfg["storage"]["media_root"])
+            except Exception as e:
+                # You could log this to a file if you want
+                print("Error formatting/mounting device:", e)
+
+        if "wifi" in changed:
+            apply_wifi_config(cfg)
+        compose_changed = False
+        if changed & {"apps", "storage"}:
+            compose_path, compose_hash, compose_changed = generate_docker_compose(cfg)
+        if changed & {"sync", "storage"}:
+            apply_sync_config(cfg)
+        _flush_pending()
+
+        # Bring up Docker stack, but only when the compose content differs
+        # from the last successful deploy -- a rebuild costs minutes on a Pi.
+        if compose_changed:
+            try:
+                _LOG.clear()
+                if docker is not None:
+                    _deploy_stack(cfg)
+                    _ensure_dir(_COMPOSE_HASH_PATH.parent)
+                    _COMPOSE_HASH_PATH.write_text(compose_hash)
+                else:
+                    # docker-py not installed; fall back to the compose CLI
+                    proc = subprocess.Popen(
+                        ["docker", "compose", "-f", str(compose_path), "up", "-d", "--build"],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        bufsize=1,
+                        text=True,
+                    )
+                    for line in proc.stdout:
+                        _LOG.append(line)
+                    proc.wait()
+                    if proc.returncode == 0:
+                        _ensure_dir(_COMPOSE_HASH_PATH.parent)
+                        _COMPOSE_HASH_PATH.write_text(compose_hash)
+            except Exception:
+                pass
+    except Exception as e:
+        _APPLY_STATE["state"] = "error"
+        _APPLY_STATE["error"] = str(e)
+    else:
+        _APPLY_STATE["state"] = "done"
+
+
+# Templates live on disk and are loaded+compiled exactly once at import;
+# the form goes through app.jinja_env so Flask's HTML autoescaping applies.
+_TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+_FORM_TMPL = app.jinja_env.from_string((_TEMPLATE_DIR / "form.html.j2").read_text())
+_COMPOSE_TMPL = Template((_TEMPLATE_DIR / "compose.yml.j2").read_text())
 
 
 @app.route("/")
 def index():
-    return redirect(url_for("setup"))
+    # 308 so browsers cache the redirect and skip the round-trip next visit
+    return redirect(url_for("setup"), code=308)
+
+
+@app.route("/status")
+def status():
+    return jsonify(_APPLY_STATE)
+
+
+@app.route("/log")
+def log():
+    def generate():
+        sent = 0
+        while True:
+            lines = list(_LOG)
+            while sent < len(lines):
+                yield f"data: {lines[sent].rstrip()}\n\n"
+                sent += 1
+            if _APPLY_STATE["state"] != "running":
+                break
+            time.sleep(1)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
 
 @app.route("/setup", methods=["GET", "POST"])
+@cache.cached(timeout=60, unless=lambda: request.method == "POST")
 def setup():
     cfg = load_config()
 
     if request.method == "POST":
+        new_cfg = copy.deepcopy(cfg)
+
         # Wi-Fi
-        cfg["wifi"]["ssid"] = request.form.get("wifi_ssid", "").strip() or cfg["wifi"]["ssid"]
-        cfg["wifi"]["password"] = request.form.get("wifi_password", "").strip() or cfg["wifi"]["password"]
-        cfg["wifi"]["ip"] = request.form.get("wifi_ip", "").strip() or cfg["wifi"]["ip"]
+        new_cfg["wifi"]["ssid"] = request.form.get("wifi_ssid", "").strip() or cfg["wifi"]["ssid"]
+        new_cfg["wifi"]["password"] = request.form.get("wifi_password", "").strip() or cfg["wifi"]["password"]
+        new_cfg["wifi"]["ip"] = request.form.get("wifi_ip", "").strip() or cfg["wifi"]["ip"]
 
         # Storage
-        cfg["storage"]["media_root"] = request.form.get("media_root", "").strip() or cfg["storage"]["media_root"]
+        new_cfg["storage"]["media_root"] = request.form.get("media_root", "").strip() or cfg["storage"]["media_root"]
         storage_device = request.form.get("storage_device", "").strip()
         format_device = "format_device" in request.form
 
         # Apps
-        cfg["apps"]["install_audiobookshelf"] = "install_audiobookshelf" in request.form
-        cfg["apps"]["install_calibre_web"] = "install_calibre_web" in request.form
+        new_cfg["apps"]["install_audiobookshelf"] = "install_audiobookshelf" in request.form
+        new_cfg["apps"]["install_calibre_web"] = "install_calibre_web" in request.form
 
         # Sync
-        cfg["sync"]["enable_sync"] = "enable_sync" in request.form
-        cfg["sync"]["server_ip"] = request.form.get("server_ip", "").strip() or cfg["sync"]["server_ip"]
-        cfg["sync"]["server_path_audio"] = request.form.get("server_path_audio", "").strip() or cfg["sync"]["server_path_audio"]
-        cfg["sync"]["server_path_books"] = request.form.get("server_path_books", "").strip() or cfg["sync"]["server_path_books"]
+        new_cfg["sync"]["enable_sync"] = "enable_sync" in request.form
+        new_cfg["sync"]["server_ip"] = request.form.get("server_ip", "").strip() or cfg["sync"]["server_ip"]
+        new_cfg["sync"]["server_path_audio"] = request.form.get("server_path_audio", "").strip() or cfg["sync"]["server_path_audio"]
+        new_cfg["sync"]["server_path_books"] = request.form.get("server_path_books", "").strip() or cfg["sync"]["server_path_books"]
 
-        save_config(cfg)
+        changed = {section for section in new_cfg if new_cfg[section] != cfg[section]}
 
-        # If user selected a device and checked the format box, do the destructive format+mount
-        if storage_device and format_device:
-            try:
-                format_and_mount_device(storage_device, cfg["storage"]["media_root"])
-            except Exception as e:
-                # You could log this to a file if you want
-                print("Error formatting/mounting device:", e)
+        # Idempotent resubmit (refresh, double-click Apply): nothing to
+        # save or apply unless a destructive format was explicitly asked for.
+        if not changed and not (storage_device and format_device):
+            return redirect(url_for("setup"))
 
-        # Apply configs
-        apply_wifi_config(cfg)
-        compose_path = generate_docker_compose(cfg)
-        apply_sync_config(cfg)
+        if changed:
+            save_config(new_cfg)
+            # Drop the memoized GET page so the next load shows the new values
+            cache.delete("view/%s" % url_for("setup"))
 
-        # Bring up Docker stack
-        try:
-            subprocess.run(["docker", "compose", "-f", str(compose_path), "up", "-d", "--build"], check=False)
-        except Exception:
-            pass
+        # Apply in the background; the restarts/builds take seconds-minutes
+        # and would otherwise hold the single Flask worker captive.
+        _EXEC.submit(_apply_all, new_cfg, storage_device, format_device, changed)
 
         return redirect(url_for("setup"))
 
     # GET
     devices = get_storage_devices()
-    return render_template_string(FORM_TEMPLATE, cfg=cfg, devices=devices)
+    return _FORM_TMPL.render(cfg=cfg, devices=devices)
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=9000)
+    try:
+        # Multi-threaded WSGI server so GETs (and /status polls) stay
+        # responsive while a background apply is running.
+        from waitress import serve
+
+        serve(app, host="0.0.0.0", port=9000, threads=4)
+    except ImportError:
+        app.run(host="0.0.0.0", port=9000, threaded=True)